@@ -1,15 +1,24 @@
 import asyncio
 import ssl
 
-import aiohttp
+import httpx
 import json
 from typing import Optional
 
+try:
+    from orjson import dumps as _dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 BASE_URL = "https://api.music.yandex.net/artists"
 MAX_CONCURRENT = 100
 CONSECUTIVE_FAIL_LIMIT = 100
 START_ID = 10017196
 MAX_RETRIES = 3
+TIMEOUT = httpx.Timeout(10)
+WRITE_BUFFER = 1 << 16   # 64 KiB
+FLUSH_EVERY = 100
 
 results = {}
 lock = asyncio.Lock()
@@ -19,62 +28,91 @@ ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
 
-async def fetch_artist(session: aiohttp.ClientSession, artist_id: int) -> Optional[dict]:
+async def fetch_artist(client: httpx.AsyncClient, artist_id: int) -> Optional[dict]:
     url = f"{BASE_URL}/{artist_id}/brief-info"
     retry_delay = 5
     try:
         for att in range(MAX_RETRIES):
             print(f'trying to fetch {url}')
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10), ssl_context=ssl_context) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return {"id": artist_id, "data": data}
-                elif resp.status == 429:
-                    wait = int(resp.headers.get("Retry-After", retry_delay))
-                    print(f"[{artist_id}] Rate limited, waiting {wait}s (attempt {att + 1})")
-                    await asyncio.sleep(wait)
-                    retry_delay *= 2
-                elif resp.status == 404:
-                    return None
-                else:
-                    print(f"[{artist_id}] Unexpected status: {resp.status}")
-                    return None
+            resp = await client.get(url)
+            if resp.status_code == 200:
+                data = resp.json()
+                return {"id": artist_id, "data": data}
+            elif resp.status_code == 429:
+                wait = int(resp.headers.get("Retry-After", retry_delay))
+                print(f"[{artist_id}] Rate limited, waiting {wait}s (attempt {att + 1})")
+                await asyncio.sleep(wait)
+                retry_delay *= 2
+            elif resp.status_code == 404:
+                return None
+            else:
+                print(f"[{artist_id}] Unexpected status: {resp.status_code}")
+                return None
     except Exception as e:
         print(f"[{artist_id}] Error: {e}")
         return None
 
 
+async def write_results(queue: asyncio.Queue) -> None:
+    """Single writer: drains (artist_id, result) pairs until it gets None."""
+    written = 0
+    with open("artists.jsonl", "ab", buffering=WRITE_BUFFER) as f:
+        while (item := await queue.get()) is not None:
+            aid, result = item
+            f.write(_dumps({"id": aid, "data": result}) + b"\n")
+            written += 1
+            if written % FLUSH_EVERY == 0:
+                f.flush()
+            print(f"[✓] ID {aid} collected")
+
+
 async def main():
-    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT)
+    limits = httpx.Limits(max_connections=MAX_CONCURRENT)
     headers = {'User-Agent': 'PostmanRuntime/7.29.0'}
 
-    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+    # Sliding window: a new request starts as soon as any in-flight one
+    # finishes, so a slow response no longer stalls a whole batch
+    sem = asyncio.Semaphore(MAX_CONCURRENT)
+    queue = asyncio.Queue()
+    in_flight = set()
+
+    # HTTP/2 multiplexes the concurrent requests over a few TLS connections
+    async with httpx.AsyncClient(http2=True, limits=limits, headers=headers,
+                                 timeout=TIMEOUT, verify=ssl_context) as client:
         artist_id = START_ID
         consecutive_failures = 0
         total_collected = 0
 
-        with open("artists.jsonl", "a") as f:
-            while consecutive_failures < CONSECUTIVE_FAIL_LIMIT:
-                batch_ids = list(range(artist_id, artist_id + MAX_CONCURRENT))
-                artist_id += MAX_CONCURRENT
-
-                tasks = [fetch_artist(session, aid) for aid in batch_ids]
-                batch_results = await asyncio.gather(*tasks)
-
-                any_success = False
-                for aid, result in zip(batch_ids, batch_results):
-                    if result:
-                        f.write(json.dumps({"id": aid, "data": result}) + "\n")
-                        f.flush()
-                        total_collected += 1
-                        any_success = True
-                        consecutive_failures = 0
-                        print(f"[✓] ID {aid} collected")
-
-                if not any_success:
-                    consecutive_failures += MAX_CONCURRENT
-                    print(
-                        f"[~] Batch {batch_ids[0]}-{batch_ids[-1]} all empty ({consecutive_failures}/{CONSECUTIVE_FAIL_LIMIT} consecutive fails)")
+        async def fetch(aid: int):
+            return aid, await fetch_artist(client, aid)
+
+        def on_done(task: asyncio.Task) -> None:
+            nonlocal consecutive_failures, total_collected
+            sem.release()
+            in_flight.discard(task)
+            aid, result = task.result()
+            if result:
+                queue.put_nowait((aid, result))
+                total_collected += 1
+                consecutive_failures = 0
+            else:
+                consecutive_failures += 1
+
+        writer = asyncio.create_task(write_results(queue))
+        while True:
+            await sem.acquire()
+            if consecutive_failures >= CONSECUTIVE_FAIL_LIMIT:
+                break
+            task = asyncio.create_task(fetch(artist_id))
+            task.add_done_callback(on_done)
+            in_flight.add(task)
+            artist_id += 1
+
+        print(f"[~] {consecutive_failures} consecutive empty IDs before {artist_id}, stopping")
+        if in_flight:
+            await asyncio.wait(in_flight)
+        queue.put_nowait(None)
+        await writer
 
         print(f"\nDone. Collected {total_collected} artists.")
 
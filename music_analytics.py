@@ -5,18 +5,34 @@ Streams JSONL into SQLite, then plots monthly listeners for all artists.
 
 Usage:
     python music_analytics.py --file your_data.jsonl [--out listeners.png] [--db keep.db]
+                              [--workers N] [--show]
 """
 
-import json
+import io
 import argparse
+import os
 import sqlite3
 import sys
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+try:
+    import apsw
+except ImportError:
+    apsw = None
+
 
 # ─────────────────────────────────────────────
 # Database setup
@@ -38,149 +54,399 @@ CREATE TABLE IF NOT EXISTS artists (
 
 CREATE TABLE IF NOT EXISTS genres (
     artist_id TEXT,
-    genre     TEXT,
-    PRIMARY KEY (artist_id, genre)
+    genre     TEXT
 );
 
 CREATE TABLE IF NOT EXISTS albums (
     artist_id   TEXT,
     title       TEXT,
     year        INTEGER,
-    track_count INTEGER DEFAULT 0,
-    PRIMARY KEY (artist_id, title)
+    track_count INTEGER DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS popular_tracks (
     artist_id  TEXT,
     position   INTEGER,
     title      TEXT,
-    duration_s REAL,
-    PRIMARY KEY (artist_id, position)
+    duration_s REAL
 );
 """
 
+# (index, table, key columns) — built once after the bulk load instead of
+# maintained on every insert. See build_indexes().
+POST_INGEST_INDEXES = (
+    ("genres_pk",         "genres",         ("artist_id", "genre")),
+    ("albums_pk",         "albums",         ("artist_id", "title")),
+    ("popular_tracks_pk", "popular_tracks", ("artist_id", "position")),
+)
+
+ARTIST_UPSERT_SQL = """
+INSERT INTO artists
+    (id, name, tracks, direct_albums, also_albums, also_tracks,
+     monthly_listeners, likes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    tracks            = MAX(tracks,            excluded.tracks),
+    direct_albums     = MAX(direct_albums,     excluded.direct_albums),
+    also_albums       = MAX(also_albums,       excluded.also_albums),
+    also_tracks       = MAX(also_tracks,       excluded.also_tracks),
+    monthly_listeners = MAX(monthly_listeners, excluded.monthly_listeners),
+    likes             = MAX(likes,             excluded.likes)
+"""
+
+GENRE_INSERT_SQL = "INSERT OR IGNORE INTO genres VALUES (?, ?)"
+
+ALBUM_INSERT_SQL = """
+INSERT OR IGNORE INTO albums (artist_id, title, year, track_count)
+VALUES (?, ?, ?, ?)
+"""
+
+# ingest() only sends an artist's first track list; see has_tracks there
+TRACK_INSERT_SQL = """
+INSERT OR IGNORE INTO popular_tracks (artist_id, position, title, duration_s)
+VALUES (?, ?, ?, ?)
+"""
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",   # 256 MiB
+    "PRAGMA cache_size=-65536",     # 64 MiB
+)
+
+
 def open_db(path: str) -> sqlite3.Connection:
     con = sqlite3.connect(path)
-    con.execute("PRAGMA journal_mode=WAL")
-    con.execute("PRAGMA synchronous=NORMAL")
+    for pragma in PRAGMAS:
+        con.execute(pragma)
     con.executescript(SCHEMA)
     return con
 
 
+def open_ingest_db(path: str):
+    """
+    Connection for the bulk load: apsw when installed (a much thinner
+    binding over the SQLite C API), otherwise a regular sqlite3 one.
+    ingest() only uses execute / executemany, which both provide.
+    """
+    if apsw is None:
+        return open_db(path)
+    con = apsw.Connection(path)
+    for pragma in PRAGMAS:
+        con.execute(pragma)
+    con.execute(SCHEMA)
+    return con
+
+
 # ─────────────────────────────────────────────
 # Streaming ingest
 # ─────────────────────────────────────────────
 
+OVERSIZE_LINE_BYTES = 1_000_000
+
+# Paths ingest() reads; an oversize line is pruned down to just these
+_OVERSIZE_FIELDS = (
+    "data.data.result.artist.id",
+    "data.data.result.artist.name",
+    "data.data.result.artist.available",
+    "data.data.result.artist.likesCount",
+    "data.data.result.artist.counts",
+    "data.data.result.artist.genres",
+    "data.data.result.stats.lastMonthListeners",
+    "data.data.result.albums.item.title",
+    "data.data.result.albums.item.year",
+    "data.data.result.albums.item.trackCount",
+    "data.data.result.popularTracks.item.title",
+    "data.data.result.popularTracks.item.durationMs",
+)
+_OVERSIZE_KEEP = {""} | {
+    f.rsplit(".", i)[0] for f in _OVERSIZE_FIELDS for i in range(f.count(".") + 1)
+}
+_OVERSIZE_SUBTREES = tuple(f + "." for f in _OVERSIZE_FIELDS)
+
+
+def _parse_oversize(line: bytes):
+    """
+    Stream an oversize line through ijson, building only the paths in
+    _OVERSIZE_FIELDS instead of the full object tree.
+    Falls back to a regular parse if ijson is not installed.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return _loads(line)
+
+    root, stack, key, skip = None, [], None, 0
+    try:
+        for prefix, event, value in ijson.parse(io.BytesIO(line), use_float=True):
+            if skip:                        # inside a container we don't need
+                if event in ("start_map", "start_array"):
+                    skip += 1
+                elif event in ("end_map", "end_array"):
+                    skip -= 1
+                continue
+            if event == "map_key":
+                key = value
+                continue
+            if event in ("end_map", "end_array"):
+                stack.pop()
+                continue
+            if prefix not in _OVERSIZE_KEEP and not prefix.startswith(_OVERSIZE_SUBTREES):
+                if event in ("start_map", "start_array"):
+                    skip = 1
+                continue
+
+            node = {} if event == "start_map" else [] if event == "start_array" else value
+            if not stack:
+                root = node
+            elif isinstance(stack[-1], list):
+                stack[-1].append(node)
+            else:
+                stack[-1][key] = node
+            if event in ("start_map", "start_array"):
+                stack.append(node)
+    except ijson.JSONError as e:
+        raise ValueError(e) from None
+    return root
+
+
+def _parse_line(line: bytes):
+    if len(line) > OVERSIZE_LINE_BYTES:
+        return _parse_oversize(line)
+    return _loads(line)
+
+
 def iter_records(path: str):
-    with open(path, encoding="utf-8") as f:
+    with open(path, "rb") as f:
         for lineno, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
+            if line.isspace():
                 continue
             try:
-                yield json.loads(line)
-            except json.JSONDecodeError as e:
+                yield _parse_line(line)
+            except ValueError as e:
                 print(f"[WARN] Line {lineno} skipped: {e}", file=sys.stderr)
 
 
-def ingest(path: str, con: sqlite3.Connection) -> tuple[int, int, int]:
-    total = skipped = more_threshold = 0
+def extract_artist(record: dict):
+    """
+    Flatten one record into SQL parameter tuples plus the threshold flag:
+    (artist_row, genre_rows, album_rows, track_rows, over_threshold), or None
+    if the artist is unavailable. Malformed records raise KeyError / TypeError.
+    """
+    result = record["data"]["data"]["result"]
+    artist = result["artist"]
+    a_get  = artist.get
+    if not a_get("available", False):
+        return None
+
+    aid    = artist["id"]
+    r_get  = result.get
+    c_get  = a_get("counts", {}).get
+    listeners = r_get("stats", {}).get("lastMonthListeners", 0)
+    over_threshold = listeners >= LIST_THRESHOLD     # TypeError on null listeners
+
+    artist_row = (
+        aid, artist["name"],
+        c_get("tracks", 0),
+        c_get("directAlbums", 0),
+        c_get("alsoAlbums", 0),
+        c_get("alsoTracks", 0),
+        listeners,
+        a_get("likesCount", 0),
+    )
+    genre_rows = [(aid, g) for g in a_get("genres", [])]
+    album_rows = [(aid, a.get("title", ""), a.get("year"), a.get("trackCount", 0))
+                  for a in r_get("albums", [])]
+    track_rows = [(aid, pos, t.get("title", ""), t.get("durationMs", 0) / 1000)
+                  for pos, t in enumerate(r_get("popularTracks", []))]
+    return artist_row, genre_rows, album_rows, track_rows, over_threshold
+
+
+def _extract(record):
+    """extract_artist(), with malformed records mapped to None like unavailable ones."""
+    try:
+        return extract_artist(record)
+    except (KeyError, TypeError):
+        return None
 
-    for record in iter_records(path):
-        total += 1
-        try:
-            result = record["data"]["data"]["result"]
-            artist = result["artist"]
-            if not artist.get("available", False):
-                skipped += 1
+
+CHUNK_BYTES = 32 << 20
+
+
+def _extract_chunk(path: str, start: int, end: int) -> list:
+    """
+    Parse and extract every line that starts inside the byte range
+    [start, end). Runs in a worker, so only the row tuples go back.
+    """
+    rows = []
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()                # skip the line owned by the previous chunk
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            offset, pos = pos, pos + len(line)
+            if line.isspace():
                 continue
+            try:
+                record = _parse_line(line)
+            except ValueError as e:
+                print(f"[WARN] Byte offset {offset} skipped: {e}", file=sys.stderr)
+                continue
+            rows.append(_extract(record))
+    return rows
+
+
+def iter_rows_parallel(path: str, workers: int):
+    """
+    Same as map(_extract, iter_records(path)), run by a process pool.
+    The file is split into newline-aligned byte ranges; order is preserved.
+    At most 2 × workers chunks are in flight or waiting, so a slow consumer
+    doesn't pile up extracted chunks in memory.
+    """
+    size = os.path.getsize(path)
+    n_chunks = max(workers, -(-size // CHUNK_BYTES))
+    bounds = [size * i // n_chunks for i in range(n_chunks + 1)]
+    ranges = zip(bounds[:-1], bounds[1:])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque(pool.submit(_extract_chunk, path, start, end)
+                       for start, end in islice(ranges, 2 * workers))
+        while window:
+            rows = window.popleft().result()
+            for start, end in islice(ranges, 1):
+                window.append(pool.submit(_extract_chunk, path, start, end))
+            yield from rows
+
+
+BATCH_SIZE = 5000
 
-            aid    = artist["id"]
-            name   = artist["name"]
-            counts = artist.get("counts", {})
-            stats  = result.get("stats", {})
-
-            con.execute("""
-                INSERT INTO artists
-                    (id, name, tracks, direct_albums, also_albums, also_tracks,
-                     monthly_listeners, likes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(id) DO UPDATE SET
-                    tracks            = MAX(tracks,            excluded.tracks),
-                    direct_albums     = MAX(direct_albums,     excluded.direct_albums),
-                    also_albums       = MAX(also_albums,       excluded.also_albums),
-                    also_tracks       = MAX(also_tracks,       excluded.also_tracks),
-                    monthly_listeners = MAX(monthly_listeners, excluded.monthly_listeners),
-                    likes             = MAX(likes,             excluded.likes)
-            """, (
-                aid, name,
-                counts.get("tracks", 0),
-                counts.get("directAlbums", 0),
-                counts.get("alsoAlbums", 0),
-                counts.get("alsoTracks", 0),
-                stats.get("lastMonthListeners", 0),
-                artist.get("likesCount", 0),
-            ))
-
-            for g in artist.get("genres", []):
-                con.execute("INSERT OR IGNORE INTO genres VALUES (?, ?)", (aid, g))
-
-            for a in result.get("albums", []):
-                con.execute("""
-                    INSERT OR IGNORE INTO albums (artist_id, title, year, track_count)
-                    VALUES (?, ?, ?, ?)
-                """, (aid, a.get("title", ""), a.get("year"), a.get("trackCount", 0)))
-
-            existing = con.execute(
-                "SELECT COUNT(*) FROM popular_tracks WHERE artist_id=?", (aid,)
-            ).fetchone()[0]
-            if existing == 0:
-                for pos, t in enumerate(result.get("popularTracks", [])):
-                    con.execute("""
-                        INSERT OR IGNORE INTO popular_tracks
-                            (artist_id, position, title, duration_s)
-                        VALUES (?, ?, ?, ?)
-                    """, (aid, pos, t.get("title", ""), t.get("durationMs", 0) / 1000))
-            if stats.get("lastMonthListeners", 0) >= LIST_THRESHOLD:
-                more_threshold += 1
-        except (KeyError, TypeError):
+
+def ingest(path: str, con, workers: int = 1) -> tuple[int, int, int]:
+    total = skipped = more_threshold = 0
+    artist_rows, genre_rows, album_rows, track_rows = [], [], [], []
+
+    def flush():
+        # One executemany per table: each statement is prepared once per batch
+        con.executemany(ARTIST_UPSERT_SQL, artist_rows)
+        con.executemany(GENRE_INSERT_SQL,  genre_rows)
+        con.executemany(ALBUM_INSERT_SQL,  album_rows)
+        con.executemany(TRACK_INSERT_SQL,  track_rows)
+        for rows in (artist_rows, genre_rows, album_rows, track_rows):
+            rows.clear()
+
+    if workers > 1:
+        results = iter_rows_parallel(path, workers)
+    else:
+        results = map(_extract, iter_records(path))
+
+    # Bound once: flush() clears the lists in place, so these stay valid
+    add_artist, add_genres = artist_rows.append, genre_rows.extend
+    add_albums, add_tracks = album_rows.extend, track_rows.extend
+
+    # An artist keeps the popular-track list from its first record that has
+    # one — later snapshots are dropped whole, not merged in by position.
+    # Ids are compared as text, like the artist_id TEXT column does.
+    has_tracks = {aid for (aid,) in con.execute("SELECT DISTINCT artist_id FROM popular_tracks")}
+
+    con.execute("BEGIN")
+    for rows in results:
+        total += 1
+        if rows is None:
             skipped += 1
             continue
 
-        if total % 5000 == 0:
-            con.commit()
+        artist_row, genres, albums, tracks, over_threshold = rows
+        add_artist(artist_row)
+        add_genres(genres)
+        add_albums(albums)
+        if tracks:
+            aid = str(artist_row[0])
+            if aid not in has_tracks:
+                has_tracks.add(aid)
+                add_tracks(tracks)
+        if over_threshold:
+            more_threshold += 1
+
+        if total % BATCH_SIZE == 0:
+            flush()
+            con.execute("COMMIT")
+            con.execute("BEGIN")
             print(f"  … {total} records processed", flush=True)
 
-    con.commit()
+    flush()
+    con.execute("COMMIT")
     return total, skipped, more_threshold
 
 
+def build_indexes(con) -> None:
+    """
+    Create the child-table unique indexes. Duplicates are dropped first,
+    keeping the earliest row — the one INSERT OR IGNORE would have kept.
+    Rows with a NULL key column are left alone: a unique index treats
+    NULLs as distinct, so they were never duplicates. Indexes that already
+    exist (reused --db) deduped during the inserts and are skipped.
+    """
+    con.execute("BEGIN")
+    for index, table, cols in POST_INGEST_INDEXES:
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                       (index,)).fetchone():
+            continue
+        keys = ", ".join(cols)
+        not_null = " AND ".join(f"{c} IS NOT NULL" for c in cols)
+        con.execute(f"""
+            DELETE FROM {table} WHERE {not_null} AND rowid NOT IN
+                (SELECT MIN(rowid) FROM {table} WHERE {not_null} GROUP BY {keys})
+        """)
+        con.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({keys})")
+    con.execute("COMMIT")
+
+
 # ─────────────────────────────────────────────
 # Plot
 # ─────────────────────────────────────────────
 
-def plot_monthly_listeners(con: sqlite3.Connection, output_path: str) -> None:
+def plot_monthly_listeners(con: sqlite3.Connection, output_path: str,
+                           show: bool = False) -> None:
     """
     Histogram of monthly listeners across ALL artists.
-    Cursor-iterated — one value at a time, never a full list in memory.
+    Values are fetched in chunks into one reusable buffer and folded into
+    fixed-size bin counts — memory is O(bins), not O(artists).
     """
-    listeners = []
-    for (val,) in con.execute(
-        "SELECT monthly_listeners FROM artists WHERE monthly_listeners > 0"
-    ):
-        listeners.append(val)
+    n, max_listeners = con.execute(
+        "SELECT COUNT(*), MAX(monthly_listeners) FROM artists WHERE monthly_listeners > 0"
+    ).fetchone()
 
-    if not listeners:
+    if not n:
         sys.exit("[ERROR] No listener data found.")
 
+    bin_width = 20000
+    n_bins = int(-(-max_listeners // bin_width))     # MAX may come back as REAL
+    counts = np.zeros(n_bins, dtype=np.int64)
+    chunk_size = 65536
+    buf = np.empty(min(n, chunk_size), dtype=np.int64)
+    cur = con.execute("SELECT monthly_listeners FROM artists WHERE monthly_listeners > 0")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = buf[:len(rows)]
+        chunk[:] = [r[0] for r in rows]
+        # Last bin is closed on the right, as in np.histogram
+        idx = np.minimum(chunk // bin_width, n_bins - 1)
+        counts += np.bincount(idx, minlength=n_bins)
+
     fig, axes = plt.subplots(1, 1, figsize=(14, 5))
-    fig.suptitle(f"Monthly Listeners — {len(listeners):,} artists",
+    fig.suptitle(f"Monthly Listeners — {n:,} artists",
                  fontsize=14, fontweight="bold")
 
     # Log scale — more useful when a few artists dominate
-    bin_width = 20000
-    bins = np.arange(0, max(listeners) + bin_width, bin_width)
-    axes.hist(listeners, bins=bins, color="#DD8452", alpha=0.85, edgecolor="white", log=True)
+    edges = np.arange(n_bins) * bin_width
+    axes.bar(edges, counts, width=bin_width, align="edge",
+             color="#DD8452", alpha=0.85, edgecolor="white", log=True)
     axes.set_title("Log scale  (shows long tail)")
     axes.set_xlabel("Listeners last month")
     axes.set_ylabel("Number of artists (log)")
@@ -189,7 +455,8 @@ def plot_monthly_listeners(con: sqlite3.Connection, output_path: str) -> None:
     plt.tight_layout()
     plt.savefig(output_path, dpi=150, bbox_inches="tight")
     print(f"[OK] Chart saved → {output_path}")
-    plt.show()
+    if show:
+        plt.show()
 
 
 # ─────────────────────────────────────────────
@@ -202,8 +469,15 @@ def main():
     parser.add_argument("--out",  default="listeners.png", help="Output image path")
     parser.add_argument("--db",   default=None,
                         help="SQLite DB path (default: temp file, deleted after run)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"Parser processes (default: 1, this machine has {os.cpu_count()})")
+    parser.add_argument("--show", action="store_true",
+                        help="Open the chart in a window after saving it")
     args = parser.parse_args()
 
+    if not args.show:
+        matplotlib.use("Agg")   # headless: skip GUI backend init
+
     if not Path(args.file).exists():
         sys.exit(f"[ERROR] File not found: {args.file}")
 
@@ -211,11 +485,16 @@ def main():
     db_path  = args.db or tempfile.mktemp(suffix=".db")
 
     try:
-        con = open_db(db_path)
+        con = open_ingest_db(db_path)
         print(f"[INFO] Ingesting {args.file} …")
-        total, skipped, more_threshold = ingest(args.file, con)
+        total, skipped, more_threshold = ingest(args.file, con, args.workers)
+        build_indexes(con)
+        con.execute("PRAGMA optimize")
+        con.close()
+
+        con = open_db(db_path)
         print(f"[INFO] Done — {total} records, {skipped} skipped, {more_threshold} is more threshold {LIST_THRESHOLD}")
-        plot_monthly_listeners(con, args.out)
+        plot_monthly_listeners(con, args.out, args.show)
         con.close()
     finally:
         if use_temp: